@@ -1,5 +1,6 @@
 # flake8: noqa: E203
 # ref. https://github.com/PyCQA/pycodestyle/issues/373, remove this for ruff
+import math
 import warnings
 
 import numpy as np
@@ -9,38 +10,36 @@ import scipy.linalg as scl
 import crocoddyl
 
 
-def a2m(a):
-    return np.matrix(a).T
-
-
-def m2a(m):
-    return np.array(m).squeeze()
-
-
-def rev_enumerate(lname):
-    return reversed(list(enumerate(lname)))
-
-
 def absmax(A):
     return np.max(abs(A))
 
 
+def isDiverging(A):
+    # NaN, inf and entries above 1e30 all fail this comparison in a single pass
+    return not np.max(np.abs(A), initial=0.0) <= 1e30
+
+
 def raiseIfNan(A, error=None):
     if error is None:
         error = scl.LinAlgError("NaN in array")
-    if np.any(np.isnan(A)) or np.any(np.isinf(A)) or np.any(abs(np.asarray(A)) > 1e30):
+    if isDiverging(A):
         raise error
 
 
 class StateVectorDerived(crocoddyl.StateAbstract):
     def __init__(self, nx):
         crocoddyl.StateAbstract.__init__(self, nx, nx)
+        # The Jacobians are constant, so we return these read-only arrays
+        self._pos_I = np.eye(self.ndx)
+        self._neg_I = -self._pos_I
+        self._pos_I.flags.writeable = False
+        self._neg_I.flags.writeable = False
 
     def zero(self):
-        return np.matrix(np.zeros(self.nx)).T
+        return np.zeros(self.nx)
 
     def rand(self):
-        return np.matrix(np.random.rand(self.nx)).T
+        return np.random.rand(self.nx)
 
     def diff(self, x0, x1):
         return x1 - x0
@@ -50,25 +49,16 @@ class StateVectorDerived(crocoddyl.StateAbstract):
 
     def Jdiff(self, x1, x2, firstsecond=crocoddyl.Jcomponent.both):
         if firstsecond == crocoddyl.Jcomponent.both:
-            return [
-                self.Jdiff(x1, x2, crocoddyl.Jcomponent.first),
-                self.Jdiff(x1, x2, crocoddyl.Jcomponent.second),
-            ]
-
-        J = np.zeros([self.ndx, self.ndx])
-        if firstsecond == crocoddyl.Jcomponent.first:
-            J[:, :] = -np.eye(self.ndx)
+            return [self._neg_I, self._pos_I]
+        elif firstsecond == crocoddyl.Jcomponent.first:
+            return self._neg_I
         elif firstsecond == crocoddyl.Jcomponent.second:
-            J[:, :] = np.eye(self.ndx)
-        return J
+            return self._pos_I
 
     def Jintegrate(self, x, dx, firstsecond=crocoddyl.Jcomponent.both):
         if firstsecond == crocoddyl.Jcomponent.both:
-            return [
-                self.Jintegrate(x, dx, crocoddyl.Jcomponent.first),
-                self.Jintegrate(x, dx, crocoddyl.Jcomponent.second),
-            ]
-        return np.eye(self.ndx)
+            return [self._pos_I, self._pos_I]
+        return self._pos_I
 
 
 class StateMultibodyDerived(crocoddyl.StateAbstract):
@@ -116,13 +106,13 @@ class StateMultibodyDerived(crocoddyl.StateAbstract):
             q = x2[: self.model.nq]
             dq = dx[: self.model.nv]
             Jdq = pinocchio.dIntegrate(self.model, q, dq)[1]
-            return np.matrix(-scl.block_diag(np.linalg.inv(Jdq), np.eye(self.nv)))
+            return -scl.block_diag(np.linalg.inv(Jdq), np.eye(self.nv))
         elif firstsecond == crocoddyl.Jcomponent.second:
             dx = self.diff(x1, x2)
             q = x1[: self.nq]
             dq = dx[: self.nv]
             Jdq = pinocchio.dIntegrate(self.model, q, dq)[1]
-            return np.matrix(scl.block_diag(np.linalg.inv(Jdq), np.eye(self.nv)))
+            return scl.block_diag(np.linalg.inv(Jdq), np.eye(self.nv))
 
     def Jintegrate(self, x, dx, firstsecond=crocoddyl.Jcomponent.both):
         if firstsecond == crocoddyl.Jcomponent.both:
@@ -135,9 +125,9 @@ class StateMultibodyDerived(crocoddyl.StateAbstract):
         dq = dx[: self.nv]
         Jq, Jdq = pinocchio.dIntegrate(self.model, q, dq)
         if firstsecond == crocoddyl.Jcomponent.first:
-            return np.matrix(scl.block_diag(np.linalg.inv(Jq), np.eye(self.nv)))
+            return scl.block_diag(np.linalg.inv(Jq), np.eye(self.nv))
         elif firstsecond == crocoddyl.Jcomponent.second:
-            return np.matrix(scl.block_diag(np.linalg.inv(Jdq), np.eye(self.nv)))
+            return scl.block_diag(np.linalg.inv(Jdq), np.eye(self.nv))
 
 
 class SquashingSmoothSatDerived(crocoddyl.SquashingModelAbstract):
@@ -201,31 +191,33 @@ class UnicycleModelDerived(crocoddyl.ActionModelAbstract):
             u = self.unone
         v, w = u
         px, py, theta = x
-        c, s, dt = np.cos(theta), np.sin(theta), self.dt
+        c, s, dt = math.cos(theta), math.sin(theta), self.dt
         # Rollout the dynamics
-        data.xnext[0] = px + c * v * dt
-        data.xnext[1] = py + s * v * dt
-        data.xnext[2] = theta + w * dt
+        data.xnext[:] = (px + c * v * dt, py + s * v * dt, theta + w * dt)
         # Compute the cost value
-        data.r[:3] = self.costWeights[0] * x
-        data.r[3:] = self.costWeights[1] * u
-        data.cost = 0.5 * sum(data.r**2)
+        r, nx = data.r, self.state.nx
+        wx, wu = self.costWeights
+        r[:nx] = wx * x
+        r[nx:] = wu * u
+        data.cost = 0.5 * np.dot(r, r)
 
     def calcDiff(self, data, x, u=None):
         if u is None:
             u = self.unone
         v = u[0]
         theta = x[2]
+        wx, wu = self.costWeights
         # Cost derivatives
-        data.Lx[:] = x * ([self.costWeights[0] ** 2] * self.state.nx)
-        data.Lu[:] = u * ([self.costWeights[1] ** 2] * self.nu)
+        data.Lx[:] = (wx * wx) * x
+        data.Lu[:] = (wu * wu) * u
         # Dynamic derivatives
-        c, s, dt = np.cos(theta), np.sin(theta), self.dt
-        data.Fx[0, 2] = -s * v * dt
-        data.Fx[1, 2] = c * v * dt
-        data.Fu[0, 0] = c * dt
-        data.Fu[1, 0] = s * dt
-        data.Fu[2, 1] = dt
+        c, s, dt = math.cos(theta), math.sin(theta), self.dt
+        Fx, Fu = data.Fx, data.Fu
+        Fx[0, 2] = -s * v * dt
+        Fx[1, 2] = c * v * dt
+        Fu[0, 0] = c * dt
+        Fu[1, 0] = s * dt
+        Fu[2, 1] = dt
 
     def createData(self):
         data = UnicycleDataDerived(self)
@@ -236,8 +228,9 @@ class UnicycleDataDerived(crocoddyl.ActionDataAbstract):
     def __init__(self, model):
         crocoddyl.ActionDataAbstract.__init__(self, model)
         nx, nu = model.state.nx, model.nu
-        self.Lxx[range(nx), range(nx)] = [model.costWeights[0] ** 2] * nx
-        self.Luu[range(nu), range(nu)] = [model.costWeights[1] ** 2] * nu
+        wx, wu = model.costWeights
+        self.Lxx[range(nx), range(nx)] = wx**2
+        self.Luu[range(nu), range(nu)] = wu**2
         self.Fx[0, 0] = 1
         self.Fx[1, 1] = 1
         self.Fx[2, 2] = 1
@@ -345,7 +338,7 @@ class DifferentialFreeFwdDynamicsModelDerived(
         self.actuation = actuationModel
         self.costs = costModel
         self.enable_force = True
-        self.armature = np.matrix(np.zeros(0))
+        self.armature = np.zeros(0)
 
     def calc(self, data, x, u=None):
         if u is None:
@@ -449,7 +442,7 @@ class IntegratedActionModelEulerDerived(crocoddyl.ActionModelAbstract):
             data.cost = dt * data.differential.cost
         # data.xnext[nq:] = x[nq:] + acc*dt
         # data.xnext[:nq] = pinocchio.integrate(
-        # self.differential.pinocchio, a2m(x[:nq]), a2m(data.xnext[nq:] * dt)
+        # self.differential.pinocchio, x[:nq], data.xnext[nq:] * dt
         # ).flat
         data.dx = np.concatenate([x[nq:] * dt + acc * dt**2, acc * dt])
         data.xnext[:] = self.differential.state.integrate(x, data.dx)
@@ -1651,6 +1644,9 @@ class Impulse6DDataDerived(crocoddyl.ImpulseDataAbstract):
 
 
 class DDPDerived(crocoddyl.SolverAbstract):
+    # Diverging rollouts make tryStep return NaN, set it to raise for debugging
+    raiseOnNan = False
+
     def __init__(self, shootingProblem):
         crocoddyl.SolverAbstract.__init__(self, shootingProblem)
         self.allocateData()  # TODO remove it?
@@ -1675,8 +1671,10 @@ class DDPDerived(crocoddyl.SolverAbstract):
         self.preg = regInit if regInit is not None else self.reg_min
         self.dreg = regInit if regInit is not None else self.reg_min
         self.wasFeasible = False
+        alphas = np.asarray(self.alphas, dtype=float)
+        recalc = True
         for i in range(maxiter):
-            recalc = True
+            self.iter = i
             while True:
                 try:
                     self.computeDirection(recalc=recalc)
@@ -1691,31 +1689,36 @@ class DDPDerived(crocoddyl.SolverAbstract):
             self.d = self.expectedImprovement()
             d1, d2 = self.d[0], self.d[1]
 
-            for a in self.alphas:
-                try:
-                    self.dV = self.tryStep(a)
-                except ArithmeticError:
+            # Steps without a predicted descent are never accepted, so we skip their
+            # rollouts. The derivatives only need to be recomputed once a step is
+            # accepted.
+            dV_exps = alphas * (d1 + 0.5 * d2 * alphas)
+            recalc = False
+            for a, dV_exp in zip(alphas.tolist(), dV_exps.tolist()):
+                if not dV_exp >= 0:
                     continue
-                self.dV_exp = a * (d1 + 0.5 * d2 * a)
-                if self.dV_exp >= 0:
-                    if (
-                        d1 < self.th_grad
-                        or not self.isFeasible
-                        or self.dV > self.th_acceptStep * self.dV_exp
-                    ):
-                        # Accept step
-                        self.wasFeasible = self.isFeasible
-                        self.setCandidate(self.xs_try, self.us_try, True)
-                        self.cost = self.cost_try
-                        break
+                self.dV = self.tryStep(a)
+                if math.isnan(self.dV):
+                    continue
+                self.dV_exp = dV_exp
+                if (
+                    d1 < self.th_grad
+                    or not self.isFeasible
+                    or self.dV > self.th_acceptStep * self.dV_exp
+                ):
+                    # Accept step
+                    self.wasFeasible = self.isFeasible
+                    self.setCandidate(self.xs_try, self.us_try, True)
+                    self.cost = self.cost_try
+                    recalc = True
+                    break
             if a > self.th_step:
                 self.decreaseRegularization()
-            if a == self.alphas[-1]:
+            if a == alphas[-1]:
                 self.increaseRegularization()
                 if self.preg == self.reg_max:
                     return self.xs, self.us, False
             self.stepLength = a
-            self.iter = i
             self.stop = self.stoppingCriteria()
             if self.callbacks is not None:
                 [c(self) for c in self.callbacks]
@@ -1731,34 +1734,44 @@ class DDPDerived(crocoddyl.SolverAbstract):
         return [np.nan] * (self.problem.T + 1), self.k, self.Vx
 
     def tryStep(self, stepLength=1):
-        self.forwardPass(stepLength)
+        if not self.forwardPass(stepLength):
+            if self.raiseOnNan:
+                raise ArithmeticError("forward error")
+            return np.nan
         return self.cost - self.cost_try
 
     def stoppingCriteria(self):
         return np.abs(self.d[0] + 0.5 * self.d[1])
 
     def expectedImprovement(self):
-        d1 = sum([np.dot(q.T, k) for q, k in zip(self.Qu, self.k)])
-        d2 = sum([-np.dot(k.T, np.dot(q, k)) for q, k in zip(self.Quu, self.k)])
+        if self.k_stack is not None:
+            d1 = np.einsum("ti,ti->", self.Qu_stack, self.k_stack)
+            d2 = -np.einsum("ti,tij,tj->", self.k_stack, self.Quu_stack, self.k_stack)
+        else:
+            d1 = sum([np.dot(q, k) for q, k in zip(self.Qu, self.k)])
+            d2 = sum([-np.dot(k, np.dot(q, k)) for q, k in zip(self.Quu, self.k)])
         return np.array([d1, d2])
 
     def calcDiff(self):
+        xs, us = self.xs, self.us
         if self.iter == 0:
-            self.problem.calc(self.xs, self.us)
-        self.cost = self.problem.calcDiff(self.xs, self.us)
+            self.problem.calc(xs, us)
+        self.cost = self.problem.calcDiff(xs, us)
         if not self.isFeasible:
-            self.fs[0] = self.problem.runningModels[0].state.diff(
-                self.xs[0], self.problem.x0
-            )
-            for i, (m, d, x) in enumerate(
-                zip(self.problem.runningModels, self.problem.runningDatas, self.xs[1:])
-            ):
-                self.fs[i + 1] = m.state.diff(x, d.xnext)
+            models = self.problem.runningModels
+            datas = self.problem.runningDatas
+            self.fs = [models[0].state.diff(xs[0], self.problem.x0)] + [
+                m.state.diff(x, d.xnext) for m, d, x in zip(models, datas, xs[1:])
+            ]
         return self.cost
 
     def backwardPass(self):
-        self.Vx[-1][:] = self.problem.terminalData.Lx
-        self.Vxx[-1][:, :] = self.problem.terminalData.Lxx
+        models = self.problem.runningModels
+        datas = self.problem.runningDatas
+        fs = self.fs
+        terminalData = self.problem.terminalData
+        self.Vx[-1][:] = terminalData.Lx
+        self.Vxx[-1][:, :] = terminalData.Lxx
 
         if self.preg != 0:
             ndx = self.problem.terminalModel.state.ndx
@@ -1766,78 +1779,80 @@ class DDPDerived(crocoddyl.SolverAbstract):
 
         # Compute and store the Vx gradient at end of the interval (rollout state)
         if not self.isFeasible:
-            self.Vx[-1] += np.dot(self.Vxx[-1], self.fs[-1])
-
-        for t, (model, data) in rev_enumerate(
-            zip(self.problem.runningModels, self.problem.runningDatas)
-        ):
-            self.Qxx[t][:, :] = data.Lxx + np.dot(
-                data.Fx.T, np.dot(self.Vxx[t + 1], data.Fx)
-            )
-            self.Qxu[t][:, :] = data.Lxu + np.dot(
-                data.Fx.T, np.dot(self.Vxx[t + 1], data.Fu)
-            )
-            self.Quu[t][:, :] = data.Luu + np.dot(
-                data.Fu.T, np.dot(self.Vxx[t + 1], data.Fu)
-            )
-            self.Qx[t][:] = data.Lx + np.dot(data.Fx.T, self.Vx[t + 1])
-            self.Qu[t][:] = data.Lu + np.dot(data.Fu.T, self.Vx[t + 1])
+            self.Vx[-1] += np.dot(self.Vxx[-1], fs[-1], out=self._scratch_x)
+
+        S_xx, S_xx2, S_x = self._scratch_xx, self._scratch_xx2, self._scratch_x
+        for t in range(len(models) - 1, -1, -1):
+            model, data = models[t], datas[t]
+            S_ux, S_xu = self._scratch_ux[t], self._scratch_xu[t]
+            S_uu, S_u = self._scratch_uu[t], self._scratch_u[t]
+            Fx, Fu = data.Fx, data.Fu
+            FxTV = np.dot(Fx.T, self.Vxx[t + 1], out=S_xx)
+            FuTV = np.dot(Fu.T, self.Vxx[t + 1], out=S_ux)
+            np.add(data.Lxx, np.dot(FxTV, Fx, out=S_xx2), out=self.Qxx[t])
+            np.add(data.Lxu, np.dot(FxTV, Fu, out=S_xu), out=self.Qxu[t])
+            np.add(data.Luu, np.dot(FuTV, Fu, out=S_uu), out=self.Quu[t])
+            np.add(data.Lx, np.dot(Fx.T, self.Vx[t + 1], out=S_x), out=self.Qx[t])
+            np.add(data.Lu, np.dot(Fu.T, self.Vx[t + 1], out=S_u), out=self.Qu[t])
 
             if self.preg != 0:
                 self.Quu[t][range(model.nu), range(model.nu)] += self.preg
 
             self.computeGains(t)
 
-            self.Vx[t][:] = self.Qx[t] - np.dot(self.K[t].T, self.Qu[t])
-            self.Vxx[t][:, :] = self.Qxx[t] - np.dot(self.Qxu[t], self.K[t])
-            self.Vxx[t][:, :] = 0.5 * (
-                self.Vxx[t][:, :] + self.Vxx[t][:, :].T
-            )  # ensure symmetric
+            Vx, Vxx = self.Vx[t], self.Vxx[t]
+            np.subtract(self.Qx[t], np.dot(self.K[t].T, self.Qu[t], out=S_x), out=Vx)
+            np.subtract(self.Qxx[t], np.dot(self.Qxu[t], self.K[t], out=S_xx), out=Vxx)
+            np.multiply(np.add(Vxx, Vxx.T, out=S_xx), 0.5, out=Vxx)  # ensure symmetric
 
             if self.preg != 0:
-                self.Vxx[t][range(model.state.ndx), range(model.state.ndx)] += self.preg
+                Vxx[range(model.state.ndx), range(model.state.ndx)] += self.preg
 
             # Compute and store the Vx gradient at end of the interval (rollout state)
             if not self.isFeasible:
-                self.Vx[t] += np.dot(self.Vxx[t], self.fs[t])
+                Vx += np.dot(Vxx, fs[t], out=S_x)
 
-            raiseIfNan(self.Vxx[t], ArithmeticError("backward error"))
-            raiseIfNan(self.Vx[t], ArithmeticError("backward error"))
+            raiseIfNan(Vxx, ArithmeticError("backward error"))
+            raiseIfNan(Vx, ArithmeticError("backward error"))
 
     def forwardPass(self, stepLength, warning="ignore"):
-        xs, us = self.xs, self.us
-        xtry, utry = self.xs_try, self.us_try
-        ctry = 0
-        for t, (m, d) in enumerate(
-            zip(self.problem.runningModels, self.problem.runningDatas)
-        ):
-            utry[t] = (
-                us[t]
-                - self.k[t] * stepLength
-                - np.dot(self.K[t], m.state.diff(xs[t], xtry[t]))
-            )
-            with warnings.catch_warnings():
-                warnings.simplefilter(warning)
-                m.calc(d, xtry[t], utry[t])
-                xnext, cost = d.xnext, d.cost
-            xtry[t + 1] = xnext.copy()  # not sure copy helpful here.
-            ctry += cost
-            raiseIfNan([ctry, cost], ArithmeticError("forward error"))
-            raiseIfNan(xtry[t + 1], ArithmeticError("forward error"))
         with warnings.catch_warnings():
             warnings.simplefilter(warning)
-            self.problem.terminalModel.calc(self.problem.terminalData, xtry[-1])
-            ctry += self.problem.terminalData.cost
-        raiseIfNan(ctry, ArithmeticError("forward error"))
+            xs, us = self.xs, self.us
+            xtry, utry = self.xs_try, self.us_try
+            xtry[0][:] = self.problem.x0
+            ctry = 0
+            models = self.problem.runningModels
+            datas = self.problem.runningDatas
+            for t, (m, d) in enumerate(zip(models, datas)):
+                u, S_u = utry[t], self._scratch_u[t]
+                np.multiply(self.k[t], stepLength, out=u)
+                np.subtract(us[t], u, out=u)
+                u -= np.dot(self.K[t], m.state.diff(xs[t], xtry[t]), out=S_u)
+                m.calc(d, xtry[t], u)
+                xnext, cost = d.xnext, d.cost
+                xtry[t + 1][:] = xnext
+                ctry += cost
+                if isDiverging([ctry, cost]) or isDiverging(xtry[t + 1]):
+                    return False
+            terminalData = self.problem.terminalData
+            self.problem.terminalModel.calc(terminalData, xtry[-1])
+            ctry += terminalData.cost
+        if isDiverging(ctry):
+            return False
         self.cost_try = ctry
-        return xtry, utry, ctry
+        return True
 
     def computeGains(self, t):
         try:
             if self.Quu[t].shape[0] > 0:
-                Lb = scl.cho_factor(self.Quu[t])
-                self.K[t][:, :] = scl.cho_solve(Lb, self.Qux[t])
-                self.k[t][:] = scl.cho_solve(Lb, self.Qu[t])
+                # Solve for the feedback and feed-forward gains at once. NaN values
+                # propagate to Vxx and Vx, which are checked in the backward pass.
+                rhs = np.concatenate([self.Qux[t], self.Qu[t][:, None]], axis=1)
+                Lb = scl.cho_factor(self.Quu[t], check_finite=False)
+                sol = scl.cho_solve(Lb, rhs, check_finite=False)
+                self.K[t][:, :] = sol[:, :-1]
+                self.k[t][:] = sol[:, -1]
             else:
                 pass
         except scl.LinAlgError:
@@ -1856,39 +1871,78 @@ class DDPDerived(crocoddyl.SolverAbstract):
         self.dreg = self.preg
 
     def allocateData(self):
-        models = [*self.problem.runningModels.tolist(), self.problem.terminalModel]
-        self.Vxx = [np.zeros([m.state.ndx, m.state.ndx]) for m in models]
-        self.Vx = [np.zeros([m.state.ndx]) for m in models]
-
-        self.Q = [
-            np.zeros([m.state.ndx + m.nu, m.state.ndx + m.nu])
-            for m in self.problem.runningModels
-        ]
-        self.q = [np.zeros([m.state.ndx + m.nu]) for m in self.problem.runningModels]
+        runningModels = self.problem.runningModels
+        models = [*runningModels, self.problem.terminalModel]
+        # Store the trajectories, value function, Hamiltonian terms and gains in
+        # contiguous (T, ...) buffers when all the nodes share the same dimensions,
+        # so that their per-node entries are views and the whole horizon can be
+        # processed at once.
+        dims = {(m.state.nx, m.state.ndx) for m in models}
+        nus = {m.nu for m in runningModels}
+        if len(dims) == 1 and len(nus) == 1:
+            T, (nx, ndx), nu = self.problem.T, dims.pop(), nus.pop()
+            Q_stack = np.zeros([T, ndx + nu, ndx + nu])
+            q_stack = np.zeros([T, ndx + nu])
+            self.Vxx_stack = np.zeros([T + 1, ndx, ndx])
+            self.Vx_stack = np.zeros([T + 1, ndx])
+            self.Quu_stack = Q_stack[:, ndx:, ndx:]
+            self.Qu_stack = q_stack[:, ndx:]
+            self.k_stack = np.zeros([T, nu])
+            self.xs_try = list(np.full([T + 1, nx], np.nan))
+            self.us_try = list(np.full([T, nu], np.nan))
+            self.Vxx = list(self.Vxx_stack)
+            self.Vx = list(self.Vx_stack)
+            self.Q = list(Q_stack)
+            self.q = list(q_stack)
+            self.K = list(np.zeros([T, nu, ndx]))
+            self.k = list(self.k_stack)
+        else:
+            self.Vxx_stack, self.Vx_stack = None, None
+            self.Quu_stack, self.Qu_stack, self.k_stack = None, None, None
+            self.xs_try = [np.full(m.state.nx, np.nan) for m in models]
+            self.us_try = [np.full(m.nu, np.nan) for m in runningModels]
+            self.Vxx = [np.zeros([m.state.ndx, m.state.ndx]) for m in models]
+            self.Vx = [np.zeros([m.state.ndx]) for m in models]
+            self.Q = [
+                np.zeros([m.state.ndx + m.nu, m.state.ndx + m.nu])
+                for m in runningModels
+            ]
+            self.q = [np.zeros([m.state.ndx + m.nu]) for m in runningModels]
+            self.K = [np.zeros([m.nu, m.state.ndx]) for m in runningModels]
+            self.k = [np.zeros([m.nu]) for m in runningModels]
         self.Qxx = [
-            Q[: m.state.ndx, : m.state.ndx]
-            for m, Q in zip(self.problem.runningModels, self.Q)
+            Q[: m.state.ndx, : m.state.ndx] for m, Q in zip(runningModels, self.Q)
         ]
         self.Qxu = [
-            Q[: m.state.ndx, m.state.ndx :]
-            for m, Q in zip(self.problem.runningModels, self.Q)
+            Q[: m.state.ndx, m.state.ndx :] for m, Q in zip(runningModels, self.Q)
         ]
-        self.Qux = [Qxu.T for m, Qxu in zip(self.problem.runningModels, self.Qxu)]
+        self.Qux = [Qxu.T for m, Qxu in zip(runningModels, self.Qxu)]
         self.Quu = [
-            Q[m.state.ndx :, m.state.ndx :]
-            for m, Q in zip(self.problem.runningModels, self.Q)
-        ]
-        self.Qx = [q[: m.state.ndx] for m, q in zip(self.problem.runningModels, self.q)]
-        self.Qu = [q[m.state.ndx :] for m, q in zip(self.problem.runningModels, self.q)]
-
-        self.K = [np.zeros([m.nu, m.state.ndx]) for m in self.problem.runningModels]
-        self.k = [np.zeros([m.nu]) for m in self.problem.runningModels]
-
-        self.xs_try = [self.problem.x0] + [np.nan * self.problem.x0] * self.problem.T
-        self.us_try = [np.nan] * self.problem.T
-        self.fs = [np.zeros(self.problem.runningModels[0].state.ndx)] + [
-            np.zeros(m.state.ndx) for m in self.problem.runningModels
+            Q[m.state.ndx :, m.state.ndx :] for m, Q in zip(runningModels, self.Q)
         ]
+        self.Qx = [q[: m.state.ndx] for m, q in zip(runningModels, self.q)]
+        self.Qu = [q[m.state.ndx :] for m, q in zip(runningModels, self.q)]
+
+        self.xs_try[0][:] = self.problem.x0
+
+        # Scratch buffers of the backward pass. They are shared among the nodes, and
+        # the control-dependent ones are viewed with the dimension of each node.
+        ndx = self.problem.ndx
+        nu = max((m.nu for m in runningModels), default=0)
+        S_ux, S_xu, S_uu = np.empty(nu * ndx), np.empty(ndx * nu), np.empty(nu * nu)
+        S_u = np.empty(nu)
+        self._scratch_xx = np.empty([ndx, ndx])
+        self._scratch_xx2 = np.empty([ndx, ndx])
+        self._scratch_x = np.empty(ndx)
+        self._scratch_ux = []
+        self._scratch_xu = []
+        self._scratch_uu = []
+        self._scratch_u = []
+        for m in runningModels:
+            self._scratch_ux.append(S_ux[: m.nu * ndx].reshape(m.nu, ndx))
+            self._scratch_xu.append(S_xu[: ndx * m.nu].reshape(ndx, m.nu))
+            self._scratch_uu.append(S_uu[: m.nu * m.nu].reshape(m.nu, m.nu))
+            self._scratch_u.append(S_u[: m.nu])
 
 
 class FDDPDerived(DDPDerived):
@@ -1907,8 +1961,10 @@ class FDDPDerived(DDPDerived):
         self.preg = regInit if regInit is not None else self.reg_min
         self.dreg = regInit if regInit is not None else self.reg_min
         self.wasFeasible = False
+        alphas = np.asarray(self.alphas, dtype=float)
+        recalc = True
         for i in range(maxiter):
-            recalc = True
+            self.iter = i
             while True:
                 try:
                     self.computeDirection(recalc=recalc)
@@ -1922,10 +1978,11 @@ class FDDPDerived(DDPDerived):
                 break
             self.updateExpectedImprovement()
 
-            for a in self.alphas:
-                try:
-                    self.dV = self.tryStep(a)
-                except ArithmeticError:
+            # The derivatives only need to be recomputed once a step is accepted
+            recalc = False
+            for a in alphas.tolist():
+                self.dV = self.tryStep(a)
+                if math.isnan(self.dV):
                     continue
                 self.d = self.expectedImprovement()
                 d1, d2 = self.d[0], self.d[1]
@@ -1938,6 +1995,7 @@ class FDDPDerived(DDPDerived):
                             self.xs_try, self.us_try, (self.wasFeasible or a == 1)
                         )
                         self.cost = self.cost_try
+                        recalc = True
                         break
                 else:
                     # reducing the gaps by allowing a small increment in the cost value
@@ -1947,15 +2005,15 @@ class FDDPDerived(DDPDerived):
                             self.xs_try, self.us_try, (self.wasFeasible or a == 1)
                         )
                         self.cost = self.cost_try
+                        recalc = True
                         break
             if a > self.th_step:
                 self.decreaseRegularization()
-            if a == self.alphas[-1]:
+            if a == alphas[-1]:
                 self.increaseRegularization()
                 if self.preg == self.reg_max:
                     return self.xs, self.us, False
             self.stepLength = a
-            self.iter = i
             self.stop = self.stoppingCriteria()
             if self.callbacks is not None:
                 [c(self) for c in self.callbacks]
@@ -1971,85 +2029,100 @@ class FDDPDerived(DDPDerived):
         return [np.nan] * (self.problem.T + 1), self.k, self.Vx
 
     def tryStep(self, stepLength=1):
-        self.forwardPass(stepLength)
+        if not self.forwardPass(stepLength):
+            if self.raiseOnNan:
+                raise ArithmeticError("forward error")
+            return np.nan
         return self.cost - self.cost_try
 
     def updateExpectedImprovement(self):
         self.dg = 0.0
         self.dq = 0.0
-        if not self.isFeasible:
-            self.dg -= np.dot(self.Vx[-1].T, self.fs[-1])
-            self.dq += np.dot(self.fs[-1].T, np.dot(self.Vxx[-1], self.fs[-1]))
-        for t in range(self.problem.T):
-            self.dg += np.dot(self.Qu[t].T, self.k[t])
-            self.dq -= np.dot(self.k[t].T, np.dot(self.Quu[t], self.k[t]))
+        if self.k_stack is not None:
+            self.dg += np.einsum("ti,ti->", self.Qu_stack, self.k_stack)
+            self.dq -= np.einsum(
+                "ti,tij,tj->", self.k_stack, self.Quu_stack, self.k_stack
+            )
+            if not self.isFeasible:
+                fs = np.array(self.fs)
+                self.dg -= np.einsum("ti,ti->", self.Vx_stack, fs)
+                self.dq += np.einsum("ti,tij,tj->", fs, self.Vxx_stack, fs)
+        else:
+            fs = self.fs
             if not self.isFeasible:
-                self.dg -= np.dot(self.Vx[t].T, self.fs[t])
-                self.dq += np.dot(self.fs[t].T, np.dot(self.Vxx[t], self.fs[t]))
+                self.dg -= np.dot(self.Vx[-1], fs[-1])
+                self.dq += np.dot(fs[-1], np.dot(self.Vxx[-1], fs[-1]))
+            for t in range(self.problem.T):
+                self.dg += np.dot(self.Qu[t], self.k[t])
+                self.dq -= np.dot(self.k[t], np.dot(self.Quu[t], self.k[t]))
+                if not self.isFeasible:
+                    self.dg -= np.dot(self.Vx[t], fs[t])
+                    self.dq += np.dot(fs[t], np.dot(self.Vxx[t], fs[t]))
 
     def expectedImprovement(self):
         self.dv = 0.0
         if not self.isFeasible:
-            dx = self.problem.runningModels[-1].state.diff(self.xs_try[-1], self.xs[-1])
-            self.dv -= np.dot(self.fs[-1].T, np.dot(self.Vxx[-1], dx))
-            for t in range(self.problem.T):
-                dx = self.problem.runningModels[t].state.diff(
-                    self.xs_try[t], self.xs[t]
-                )
-                self.dv -= np.dot(self.fs[t].T, np.dot(self.Vxx[t], dx))
+            xs, xs_try, fs = self.xs, self.xs_try, self.fs
+            models = self.problem.runningModels
+            dx = models[-1].state.diff(xs_try[-1], xs[-1])
+            self.dv -= np.dot(fs[-1], np.dot(self.Vxx[-1], dx))
+            for t, m in enumerate(models):
+                dx = m.state.diff(xs_try[t], xs[t])
+                self.dv -= np.dot(fs[t], np.dot(self.Vxx[t], dx))
         d1 = self.dg + self.dv
         d2 = self.dq - 2 * self.dv
         return np.array([d1, d2])
 
     def calcDiff(self):
-        self.cost = self.problem.calc(self.xs, self.us)
-        self.cost = self.problem.calcDiff(self.xs, self.us)
+        xs, us = self.xs, self.us
+        # Accepted steps already ran calc on the new candidate in the forward pass
+        if self.iter == 0:
+            self.problem.calc(xs, us)
+        self.cost = self.problem.calcDiff(xs, us)
         if not self.isFeasible:
-            self.fs[0] = self.problem.runningModels[0].state.diff(
-                self.xs[0], self.problem.x0
-            )
-            for i, (m, d, x) in enumerate(
-                zip(self.problem.runningModels, self.problem.runningDatas, self.xs[1:])
-            ):
-                self.fs[i + 1] = m.state.diff(x, d.xnext)
+            models = self.problem.runningModels
+            datas = self.problem.runningDatas
+            self.fs = [models[0].state.diff(xs[0], self.problem.x0)] + [
+                m.state.diff(x, d.xnext) for m, d, x in zip(models, datas, xs[1:])
+            ]
         elif not self.wasFeasible:
             self.fs[:] = [np.zeros_like(f) for f in self.fs]
         return self.cost
 
     def forwardPass(self, stepLength, warning="ignore"):
-        xs, us = self.xs, self.us
-        xtry, utry = self.xs_try, self.us_try
-        ctry = 0
-        xnext = self.problem.x0
-        for t, (m, d) in enumerate(
-            zip(self.problem.runningModels, self.problem.runningDatas)
-        ):
-            if self.isFeasible or stepLength == 1:
-                xtry[t] = xnext.copy()
-            else:
-                xtry[t] = m.state.integrate(xnext, self.fs[t] * (stepLength - 1))
-            utry[t] = (
-                us[t]
-                - self.k[t] * stepLength
-                - np.dot(self.K[t], m.state.diff(xs[t], xtry[t]))
-            )
-            with warnings.catch_warnings():
-                warnings.simplefilter(warning)
-                m.calc(d, xtry[t], utry[t])
-                xnext, cost = d.xnext, d.cost
-            ctry += cost
-            raiseIfNan([ctry, cost], ArithmeticError("forward error"))
-            raiseIfNan(xnext, ArithmeticError("forward error"))
-        if self.isFeasible or stepLength == 1:
-            xtry[-1] = xnext.copy()
-        else:
-            xtry[-1] = self.problem.terminalModel.state.integrate(
-                xnext, self.fs[-1] * (stepLength - 1)
-            )
         with warnings.catch_warnings():
             warnings.simplefilter(warning)
-            self.problem.terminalModel.calc(self.problem.terminalData, xtry[-1])
-            ctry += self.problem.terminalData.cost
-        raiseIfNan(ctry, ArithmeticError("forward error"))
+            xs, us = self.xs, self.us
+            xtry, utry = self.xs_try, self.us_try
+            ctry = 0
+            xnext = self.problem.x0
+            fs = self.fs
+            models = self.problem.runningModels
+            datas = self.problem.runningDatas
+            for t, (m, d) in enumerate(zip(models, datas)):
+                if self.isFeasible or stepLength == 1:
+                    xtry[t][:] = xnext
+                else:
+                    xtry[t][:] = m.state.integrate(xnext, fs[t] * (stepLength - 1))
+                u, S_u = utry[t], self._scratch_u[t]
+                np.multiply(self.k[t], stepLength, out=u)
+                np.subtract(us[t], u, out=u)
+                u -= np.dot(self.K[t], m.state.diff(xs[t], xtry[t]), out=S_u)
+                m.calc(d, xtry[t], u)
+                xnext, cost = d.xnext, d.cost
+                ctry += cost
+                if isDiverging([ctry, cost]) or isDiverging(xnext):
+                    return False
+            if self.isFeasible or stepLength == 1:
+                xtry[-1][:] = xnext
+            else:
+                xtry[-1][:] = self.problem.terminalModel.state.integrate(
+                    xnext, fs[-1] * (stepLength - 1)
+                )
+            terminalData = self.problem.terminalData
+            self.problem.terminalModel.calc(terminalData, xtry[-1])
+            ctry += terminalData.cost
+        if isDiverging(ctry):
+            return False
         self.cost_try = ctry
-        return xtry, utry, ctry
+        return True
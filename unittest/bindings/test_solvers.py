@@ -12,25 +12,25 @@ import crocoddyl
 
 class SolverAbstractTestCase(unittest.TestCase):
     MODEL = None
+    RUNNING_MODELS = None
     SOLVER = None
     SOLVER_DER = None
 
     def setUp(self):
-        # Set up the solvers
-        self.T = randint(1, 21)
+        # Set up the solvers, cycling through the running models when several are
+        # given
+        runningModels = self.RUNNING_MODELS or [self.MODEL]
+        self.T = randint(len(runningModels), 21)
+        models = [runningModels[t % len(runningModels)] for t in range(self.T)]
         state = self.MODEL.state
         self.xs = []
         self.us = []
         self.xs.append(state.rand())
-        for _ in range(self.T):
+        for model in models:
             self.xs.append(state.rand())
-            self.us.append(np.random.rand(self.MODEL.nu))
-        self.PROBLEM = crocoddyl.ShootingProblem(
-            self.xs[0], [self.MODEL] * self.T, self.MODEL
-        )
-        self.PROBLEM_DER = crocoddyl.ShootingProblem(
-            self.xs[0], [self.MODEL] * self.T, self.MODEL
-        )
+            self.us.append(np.random.rand(model.nu))
+        self.PROBLEM = crocoddyl.ShootingProblem(self.xs[0], models, self.MODEL)
+        self.PROBLEM_DER = crocoddyl.ShootingProblem(self.xs[0], models, self.MODEL)
         self.solver = self.SOLVER(self.PROBLEM)
         self.solver_der = self.SOLVER_DER(self.PROBLEM_DER)
 
@@ -54,6 +54,19 @@ class SolverAbstractTestCase(unittest.TestCase):
         for k1, k2 in zip(self.solver.k, self.solver_der.k):
             self.assertTrue(np.allclose(k1, k2, atol=1e-9), "k doesn't match.")
 
+    def test_solve_after_x0_change(self):
+        # Change the initial state once the solvers are built
+        x0 = self.MODEL.state.rand()
+        self.PROBLEM.x0 = x0
+        self.PROBLEM_DER.x0 = x0
+        self.solver.solve([], [], 10)
+        self.solver_der.solve([], [], 10)
+        self.assertTrue(np.allclose(self.solver_der.xs[0], x0), "x0 isn't used.")
+        for x1, x2 in zip(self.solver.xs, self.solver_der.xs):
+            self.assertTrue(np.allclose(x1, x2, atol=1e-9), "xs doesn't match.")
+        for u1, u2 in zip(self.solver.us, self.solver_der.us):
+            self.assertTrue(np.allclose(u1, u2, atol=1e-9), "us doesn't match.")
+
     def test_compute_search_direction(self):
         # Compute the direction
         self.solver.setCandidate([], [], False)
@@ -90,6 +103,17 @@ class SolverAbstractTestCase(unittest.TestCase):
         costDer = self.solver_der.tryStep(0.5)
         self.assertAlmostEqual(cost, costDer, 9, "Wrong cost value for half step")
 
+    def test_try_step_diverging(self):
+        # Force a non-finite rollout and check that the step is rejected
+        self.solver_der.setCandidate([], [], False)
+        self.solver_der.computeDirection()
+        self.solver_der.k[0][:] = np.inf
+        self.assertTrue(np.isnan(self.solver_der.tryStep()), "Diverging step isn't NaN")
+        # Check that the diverging step raises when requested
+        self.solver_der.raiseOnNan = True
+        with self.assertRaises(ArithmeticError):
+            self.solver_der.tryStep()
+
     def test_stopping_criteria(self):
         # Run 2 iteration in order to boost test analysis
         self.solver.solve([], [], 2)
@@ -123,6 +147,20 @@ class UnicycleFDDPTest(SolverAbstractTestCase):
     SOLVER_DER = FDDPDerived
 
 
+class MixedControlDDPTest(SolverAbstractTestCase):
+    MODEL = crocoddyl.ActionModelUnicycle()
+    RUNNING_MODELS = [MODEL, crocoddyl.ActionModelLQR(3, 3)]
+    SOLVER = crocoddyl.SolverDDP
+    SOLVER_DER = DDPDerived
+
+
+class MixedControlFDDPTest(SolverAbstractTestCase):
+    MODEL = crocoddyl.ActionModelUnicycle()
+    RUNNING_MODELS = [MODEL, crocoddyl.ActionModelLQR(3, 3)]
+    SOLVER = crocoddyl.SolverFDDP
+    SOLVER_DER = FDDPDerived
+
+
 class TalosArmDDPTest(SolverAbstractTestCase):
     ROBOT_MODEL = example_robot_data.load("talos_arm").model
     STATE = crocoddyl.StateMultibody(ROBOT_MODEL)
@@ -198,6 +236,8 @@ if __name__ == "__main__":
     test_classes_to_run = [
         UnicycleDDPTest,
         UnicycleFDDPTest,
+        MixedControlDDPTest,
+        MixedControlFDDPTest,
         TalosArmDDPTest,
         TalosArmFDDPTest,
     ]